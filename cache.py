@@ -0,0 +1,109 @@
+"""
+Cache Helper Functions
+
+Redis read-through cache helpers. Caching is optional: when REDIS_URL is not
+set (or Redis is unreachable) every lookup is a miss and writes are skipped,
+so callers can always fall back to the database.
+"""
+
+import logging
+import os
+from typing import Optional
+
+from dotenv import load_dotenv
+from redis.asyncio import Redis
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+cache = None
+# True while Redis is failing, so an outage is logged once rather than per call
+_failing = False
+
+redis_url = os.getenv("REDIS_URL")
+# Keep a blackholed Redis from stalling requests until the OS TCP timeout
+redis_timeout = float(os.getenv("REDIS_TIMEOUT", 0.25))
+
+def _ok():
+    global _failing
+    if _failing:
+        logger.info("Redis cache reachable again")
+    _failing = False
+
+def _failed(op: str):
+    global _failing
+    if not _failing:
+        logger.warning("Redis %s failed; treating cache as a miss", op, exc_info=True)
+    _failing = True
+
+def connect_cache():
+    """Create the shared Redis client (call once the event loop is running)"""
+    global cache
+    if cache is None and redis_url:
+        cache = Redis.from_url(
+            redis_url,
+            socket_connect_timeout=redis_timeout,
+            socket_timeout=redis_timeout,
+        )
+    return cache
+
+async def close_cache():
+    """Close the shared Redis client"""
+    global cache
+    if cache is not None:
+        await cache.aclose()
+    cache = None
+
+def cache_enabled() -> bool:
+    """Whether a Redis client is configured"""
+    return cache is not None
+
+async def cache_get_raw(key: str) -> Optional[bytes]:
+    """Return the bytes stored under key, or None on a miss"""
+    if cache is None:
+        return None
+    try:
+        val = await cache.get(key)
+    except Exception:
+        _failed("get")
+        return None
+    _ok()
+    return val
+
+async def cache_set_raw(key: str, value: bytes, ttl: int = 300):
+    """Store already-encoded bytes under key for ttl seconds"""
+    if cache is None:
+        return
+    try:
+        await cache.set(key, value, ex=ttl)
+    except Exception:
+        _failed("set")
+        return
+    _ok()
+
+async def cache_push(key: str, value: bytes) -> bool:
+    """Append bytes to the Redis list at key; returns whether it was stored"""
+    if cache is None:
+        return False
+    try:
+        await cache.rpush(key, value)
+    except Exception:
+        _failed("push")
+        return False
+    _ok()
+    return True
+
+async def cache_invalidate(pattern: str):
+    """Delete every key matching a glob pattern (e.g. "products:*")"""
+    if cache is None:
+        return
+    try:
+        keys = [key async for key in cache.scan_iter(match=pattern)]
+        if keys:
+            await cache.delete(*keys)
+    except Exception:
+        _failed("invalidate")
+        return
+    _ok()
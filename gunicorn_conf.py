@@ -0,0 +1,26 @@
+"""
+Gunicorn configuration
+
+Production entrypoint: one Uvicorn worker (own event loop) per process.
+
+    gunicorn main:app -c gunicorn_conf.py
+"""
+
+import multiprocessing
+import os
+
+from uvicorn.workers import UvicornWorker
+
+
+class UvloopWorker(UvicornWorker):
+    """UvicornWorker pinned to uvloop + httptools"""
+
+    CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools"}
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+worker_class = "gunicorn_conf.UvloopWorker"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+keepalive = 5
+backlog = 2048
@@ -1,21 +1,111 @@
+import hashlib
+import logging
 import os
+import time
+from contextlib import asynccontextmanager
+from operator import itemgetter
 from typing import List, Optional
-from fastapi import FastAPI, HTTPException
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Query, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field, EmailStr
-from datetime import datetime
+from fastapi.openapi.utils import (
+    validation_error_definition,
+    validation_error_response_definition,
+)
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, EmailStr, TypeAdapter, ValidationError
+from datetime import datetime, timezone
+import orjson
+from bson import ObjectId
+from pymongo import UpdateOne
 
 # Database helpers
-from database import db, create_document, get_documents
+from database import connect_db, close_db, create_document
+from cache import (
+    connect_cache,
+    close_cache,
+    cache_enabled,
+    cache_get_raw,
+    cache_set_raw,
+    cache_invalidate,
+    cache_push,
+)
+
+logger = logging.getLogger(__name__)
+
+PRODUCTS_CACHE_TTL = 300
+PRODUCTS_CACHE_CONTROL = "public, max-age=60, stale-while-revalidate=300"
+
+# Compound index serving list_products' filter + sort
+PRODUCT_LIST_INDEX = "featured_1_category_1_created_at_-1"
+# Every returned field is filled server-side ($ifNull), so rows can be read
+# with a single itemgetter instead of per-field dict.get calls
+PRODUCT_PROJECTION = {
+    "title": {"$ifNull": ["$title", "Untitled"]},
+    "description": {"$ifNull": ["$description", None]},
+    "price": {"$ifNull": ["$price", None]},
+    "category": {"$ifNull": ["$category", "General"]},
+    "image": {"$ifNull": ["$image", None]},
+    "featured": {"$ifNull": ["$featured", False]},
+}
+_product_fields = itemgetter("_id", "title", "description", "price", "category", "image", "featured")
+PRODUCT_LIST_MAX = 200
+PRODUCT_CURSOR_BATCH = 100
+COLLECTIONS_CACHE_TTL = 5.0
+# Redis list holding enquiries whose background insert failed
+ENQUIRY_DEAD_LETTER_KEY = "enquiries:dead_letter"
+
+
+class MongoJSONResponse(ORJSONResponse):
+    """ORJSONResponse that stringifies ObjectId and other unknown types"""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=str, option=orjson.OPT_NON_STR_KEYS)
+
 
-app = FastAPI(title="CustomPrint Studio API", version="1.0.0")
+# Set by the lifespan handler once the Motor client is connected
+db = None
+# Only hint PRODUCT_LIST_INDEX once we know it exists
+_product_list_index_ready = False
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global db
+    db = connect_db()
+    connect_cache()
+    await ensure_indexes()
+    await seed_products_if_needed()
+    # Build the OpenAPI document now (FastAPI memoises it on app.openapi_schema)
+    # rather than on the first /docs or /openapi.json hit
+    app.openapi()
+    yield
+    await close_cache()
+    close_db()
+    db = None
+
+
+app = FastAPI(
+    title="CustomPrint Studio API",
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=MongoJSONResponse,
+)
+
+# Comma-separated CORS_ORIGINS; a frozenset keeps Starlette's origin check O(1).
+# Unset means "*" without credentials: Starlette would otherwise reflect any
+# origin together with Allow-Credentials.
+CORS_ORIGINS = frozenset(
+    o.strip() for o in os.getenv("CORS_ORIGINS", "").split(",") if o.strip()
+)
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
+    allow_origins=CORS_ORIGINS or frozenset({"*"}),
+    allow_credentials=bool(CORS_ORIGINS),
     allow_methods=["*"],
     allow_headers=["*"],
+    max_age=86400,
 )
 
 
@@ -33,6 +123,9 @@ class EnquiryIn(BaseModel):
     message: str
     reference_url: Optional[str] = None
 
+# Validates raw request bodies straight through pydantic-core's JSON parser
+_ENQUIRY_ADAPTER = TypeAdapter(EnquiryIn)
+
 class EnquiryOut(BaseModel):
     id: str
     created_at: datetime
@@ -51,69 +144,178 @@ class ProductOut(BaseModel):
 # Utility
 # -----------------------
 
-def _to_product_out(doc) -> ProductOut:
-    return ProductOut(
-        id=str(doc.get("_id")),
-        title=doc.get("title", "Untitled"),
-        description=doc.get("description"),
-        price=doc.get("price"),
-        category=doc.get("category", "General"),
-        image=doc.get("image"),
-        featured=bool(doc.get("featured", False)),
-    )
+# Served when DB not configured; encoded once at import
+_FALLBACK_BODY = orjson.dumps(
+    [
+        {
+            "id": "0",
+            "title": "Sample Product",
+            "description": "Configure DATABASE_URL and DATABASE_NAME to load real items.",
+            "price": None,
+            "category": "General",
+            "image": None,
+            "featured": True,
+        }
+    ]
+)
+
+
+_ETAG_LEN = 16
+
+
+def _etag(body: bytes) -> bytes:
+    # _ETAG_LEN hex chars; BLAKE2 is fast and plenty for change detection
+    return hashlib.blake2b(body, digest_size=8).hexdigest().encode()
+
+
+def _etag_matches(if_none_match: Optional[str], tag: str) -> bool:
+    # If-None-Match uses weak comparison (RFC 9110 13.1.2): ignore W/ prefixes
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == tag:
+            return True
+    return False
+
+
+def _json_with_etag(request: Request, body: bytes, etag: bytes) -> Response:
+    """Return body with ETag/Cache-Control, or 304 if the client has it"""
+    tag = f'"{etag.decode()}"'
+    headers = {"ETag": tag, "Cache-Control": PRODUCTS_CACHE_CONTROL}
+    if _etag_matches(request.headers.get("if-none-match"), tag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+_FALLBACK_ETAG = _etag(_FALLBACK_BODY)
+
+
+def _product_row(doc) -> dict:
+    # Relies on PRODUCT_PROJECTION filling every field
+    _id, title, description, price, category, image, featured = _product_fields(doc)
+    return {
+        "id": str(_id),
+        "title": title,
+        "description": description,
+        "price": price,
+        "category": category,
+        "image": image,
+        "featured": bool(featured),
+    }
+
+
+def _encode_products(docs) -> bytes:
+    return orjson.dumps([_product_row(doc) for doc in docs], default=str)
+
+
+async def _iter_docs(first, cursor):
+    for doc in first:
+        yield doc
+    async for doc in cursor:
+        yield doc
+
+
+async def _stream_products(first, cursor, cache_key: str):
+    """Yield the first batch then the rest of the cursor as a JSON array,
+    caching the full body once sent
+
+    The cached value is the body's ETag followed by the body, so a
+    hit can answer conditional requests without rehashing.
+    """
+    chunks = [] if cache_enabled() else None
+    sep = b"["
+    async for doc in _iter_docs(first, cursor):
+        chunk = sep + orjson.dumps(_product_row(doc), default=str)
+        sep = b","
+        if chunks is not None:
+            chunks.append(chunk)
+        yield chunk
+    tail = b"[]" if sep == b"[" else b"]"
+    yield tail
+    if chunks is not None:
+        chunks.append(tail)
+        body = b"".join(chunks)
+        await cache_set_raw(cache_key, _etag(body) + body, ttl=PRODUCTS_CACHE_TTL)
+
+
+# Demo catalogue inserted into an empty product collection. Fixed _ids make
+# the seed idempotent when several workers run it at once.
+_DEMO_PRODUCTS = (
+    {
+        "_id": ObjectId("000000000000000000000001"),
+        "title": "Precision Laser‑Cut Signage",
+        "description": "Crisp edges in acrylic/wood with custom finishes.",
+        "price": 149.0,
+        "category": "2D Laser-cut",
+        "image": "https://images.unsplash.com/photo-1518779578993-ec3579fee39f?q=80&w=1600&auto=format&fit=crop",
+        "featured": True,
+    },
+    {
+        "_id": ObjectId("000000000000000000000002"),
+        "title": "3D Trophy – Metallic Finish",
+        "description": "Award‑ready trophies with premium 3D look.",
+        "price": 249.0,
+        "category": "3D Trophy",
+        "image": "https://images.unsplash.com/photo-1513451713350-dee890297c4a?q=80&w=1600&auto=format&fit=crop",
+        "featured": True,
+    },
+    {
+        "_id": ObjectId("000000000000000000000003"),
+        "title": "3D‑Style Product Mockup",
+        "description": "Stand‑out visuals for packaging and promos.",
+        "price": 99.0,
+        "category": "3D Mockup",
+        "image": "https://images.unsplash.com/photo-1485827404703-89b55fcc595e?q=80&w=1600&auto=format&fit=crop",
+        "featured": True,
+    },
+    {
+        "_id": ObjectId("000000000000000000000004"),
+        "title": "Custom Keychains",
+        "description": "Personalised laser‑cut keychains in bulk.",
+        "price": 5.0,
+        "category": "2D Laser-cut",
+        "image": "https://images.unsplash.com/photo-1520975922133-0f775525ae37?q=80&w=1600&auto=format&fit=crop",
+        "featured": False,
+    },
+)
 
 
 # -----------------------
-# Lifecycle: seed featured products if empty
+# Lifecycle: indexes, and seed featured products if empty
 # -----------------------
-@app.on_event("startup")
-def seed_products_if_needed():
+async def ensure_indexes():
+    global _product_list_index_ready
+    try:
+        if db is None:
+            return
+        await db["product"].create_index(
+            [("featured", 1), ("category", 1), ("created_at", -1)],
+            name=PRODUCT_LIST_INDEX,
+        )
+        _product_list_index_ready = True
+    except Exception:
+        logger.warning("Could not create product index %s", PRODUCT_LIST_INDEX, exc_info=True)
+
+
+async def seed_products_if_needed():
     try:
         if db is None:
             return
-        count = db["product"].count_documents({})
+        count = await db["product"].count_documents({})
         if count == 0:
-            demo_products = [
-                {
-                    "title": "Precision Laser‑Cut Signage",
-                    "description": "Crisp edges in acrylic/wood with custom finishes.",
-                    "price": 149.0,
-                    "category": "2D Laser-cut",
-                    "image": "https://images.unsplash.com/photo-1518779578993-ec3579fee39f?q=80&w=1600&auto=format&fit=crop",
-                    "featured": True,
-                },
-                {
-                    "title": "3D Trophy – Metallic Finish",
-                    "description": "Award‑ready trophies with premium 3D look.",
-                    "price": 249.0,
-                    "category": "3D Trophy",
-                    "image": "https://images.unsplash.com/photo-1513451713350-dee890297c4a?q=80&w=1600&auto=format&fit=crop",
-                    "featured": True,
-                },
-                {
-                    "title": "3D‑Style Product Mockup",
-                    "description": "Stand‑out visuals for packaging and promos.",
-                    "price": 99.0,
-                    "category": "3D Mockup",
-                    "image": "https://images.unsplash.com/photo-1485827404703-89b55fcc595e?q=80&w=1600&auto=format&fit=crop",
-                    "featured": True,
-                },
-                {
-                    "title": "Custom Keychains",
-                    "description": "Personalised laser‑cut keychains in bulk.",
-                    "price": 5.0,
-                    "category": "2D Laser-cut",
-                    "image": "https://images.unsplash.com/photo-1520975922133-0f775525ae37?q=80&w=1600&auto=format&fit=crop",
-                    "featured": False,
-                },
-            ]
-            for p in demo_products:
-                p["created_at"] = datetime.utcnow()
-                p["updated_at"] = datetime.utcnow()
-            db["product"].insert_many(demo_products)
+            # Every Gunicorn worker runs this on startup; upserting by the
+            # fixed _id keeps the seed idempotent when they race
+            now = datetime.now(timezone.utc)
+            upserts = []
+            for p in _DEMO_PRODUCTS:
+                fields = {**p, "created_at": now, "updated_at": now}
+                _id = fields.pop("_id")
+                upserts.append(UpdateOne({"_id": _id}, {"$setOnInsert": fields}, upsert=True))
+            await db["product"].bulk_write(upserts, ordered=False)
+            await cache_invalidate("products:*")
     except Exception:
-        # Silent fail if DB not configured
-        pass
+        logger.warning("Seeding demo products failed", exc_info=True)
 
 
 # -----------------------
@@ -131,31 +333,44 @@ def hello():
 # -----------------------
 # Health / DB test
 # -----------------------
+# Last list_collection_names() result, so frequent probes don't hit Mongo
+_collections_cache = {"collections": None, "ts": 0.0}
+
+# Static parts of the /test payload, computed once at import
+_DB_URL_SET = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
+_BASE_TEST_RESPONSE = {
+    "backend": "✅ Running",
+    "database": "❌ Not Available",
+    "database_url": "❌ Not Set",
+    "database_name": "❌ Not Set",
+    "connection_status": "Not Connected",
+    "collections": [],
+}
+_CONNECTED_TEST_RESPONSE = {
+    **_BASE_TEST_RESPONSE,
+    "database": "✅ Available",
+    "database_url": _DB_URL_SET,
+    "connection_status": "Connected",
+}
+
 @app.get("/test")
-def test_database():
-    response = {
-        "backend": "✅ Running",
-        "database": "❌ Not Available",
-        "database_url": "❌ Not Set",
-        "database_name": "❌ Not Set",
-        "connection_status": "Not Connected",
-        "collections": [],
-    }
+async def test_database():
+    if db is None:
+        return _BASE_TEST_RESPONSE.copy()
 
+    response = _CONNECTED_TEST_RESPONSE.copy()
+    response["database_name"] = db.name if hasattr(db, "name") else "✅ Connected"
     try:
-        if db is not None:
-            response["database"] = "✅ Available"
-            response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
-            response["database_name"] = db.name if hasattr(db, "name") else "✅ Connected"
-            response["connection_status"] = "Connected"
-            try:
-                collections = db.list_collection_names()
-                response["collections"] = collections[:10]
-                response["database"] = "✅ Connected & Working"
-            except Exception as e:
-                response["database"] = f"⚠️ Connected but Error: {str(e)[:50]}"
+        collections = _collections_cache["collections"]
+        now = time.monotonic()
+        if collections is None or now - _collections_cache["ts"] >= COLLECTIONS_CACHE_TTL:
+            collections = await db.list_collection_names()
+            _collections_cache["collections"] = collections
+            _collections_cache["ts"] = now
+        response["collections"] = collections[:10]
+        response["database"] = "✅ Connected & Working"
     except Exception as e:
-        response["database"] = f"❌ Error: {str(e)[:50]}"
+        response["database"] = f"⚠️ Connected but Error: {str(e)[:50]}"
 
     return response
 
@@ -163,21 +378,25 @@ def test_database():
 # -----------------------
 # Products
 # -----------------------
-@app.get("/api/products", response_model=List[ProductOut])
-def list_products(featured: Optional[bool] = None, category: Optional[str] = None):
+@app.get(
+    "/api/products",
+    response_model=None,
+    responses={200: {"model": List[ProductOut]}},
+)
+async def list_products(
+    request: Request,
+    featured: Optional[bool] = None,
+    category: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=PRODUCT_LIST_MAX),
+):
     if db is None:
         # Return a minimal fallback when DB not configured
-        fallback = [
-            {
-                "_id": "0",
-                "title": "Sample Product",
-                "description": "Configure DATABASE_URL and DATABASE_NAME to load real items.",
-                "category": "General",
-                "image": None,
-                "featured": True,
-            }
-        ]
-        return [_to_product_out(doc) for doc in fallback]
+        return _json_with_etag(request, _FALLBACK_BODY, _FALLBACK_ETAG)
+
+    key = f"products:v2:{featured}:{category}:{limit}"
+    cached = await cache_get_raw(key)
+    if cached is not None:
+        return _json_with_etag(request, cached[_ETAG_LEN:], cached[:_ETAG_LEN])
 
     query = {}
     if featured is not None:
@@ -185,23 +404,119 @@ def list_products(featured: Optional[bool] = None, category: Optional[str] = Non
     if category:
         query["category"] = category
 
-    docs = list(db["product"].find(query).sort("created_at", -1))
-    return [_to_product_out(doc) for doc in docs]
+    cursor = (
+        db["product"]
+        .find(query, PRODUCT_PROJECTION)
+        .sort("created_at", -1)
+        .limit(limit)
+        .batch_size(PRODUCT_CURSOR_BATCH)
+    )
+    if len(query) == 2 and _product_list_index_ready:
+        # Both equality fields are bound, so the index yields created_at order
+        cursor = cursor.hint(PRODUCT_LIST_INDEX)
+    # Fetch the first batch up front so query errors still surface as a 500
+    first = await cursor.to_list(length=PRODUCT_CURSOR_BATCH)
+    if len(first) < PRODUCT_CURSOR_BATCH:
+        # Whole result already in hand: send it complete, with an ETag
+        body = _encode_products(first)
+        etag = _etag(body)
+        await cache_set_raw(key, etag + body, ttl=PRODUCTS_CACHE_TTL)
+        return _json_with_etag(request, body, etag)
+
+    # Larger listings are streamed; a failure past this point can only
+    # truncate the body, so don't let shared caches store it
+    return StreamingResponse(
+        _stream_products(first, cursor, key),
+        media_type="application/json",
+        headers={"Cache-Control": "no-store"},
+    )
 
 
 # -----------------------
 # Enquiries
 # -----------------------
-@app.post("/api/enquiries", response_model=EnquiryOut, status_code=201)
-def create_enquiry(payload: EnquiryIn):
+_default_openapi = app.openapi
+
+
+def _openapi():
+    # create_enquiry's 422 references HTTPValidationError, which FastAPI only
+    # registers when some route declares body/params; register it ourselves
+    if app.openapi_schema is None:
+        schemas = _default_openapi().setdefault("components", {}).setdefault("schemas", {})
+        schemas.setdefault("ValidationError", validation_error_definition)
+        schemas.setdefault("HTTPValidationError", validation_error_response_definition)
+    return app.openapi_schema
+
+
+app.openapi = _openapi
+
+
+async def _store_enquiry(data: dict):
+    # Runs after the 202 is sent. The payload is personal data, so it goes to
+    # the dead-letter list for recovery and never into the log.
     try:
-        inserted_id = create_document("enquiry", payload)
-        return EnquiryOut(id=inserted_id, created_at=datetime.utcnow())
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to submit: {str(e)}")
+        await create_document("enquiry", data)
+    except Exception:
+        saved = await cache_push(ENQUIRY_DEAD_LETTER_KEY, orjson.dumps(data, default=str))
+        logger.exception(
+            "Failed to store enquiry %s (%s)",
+            data["_id"],
+            f"saved to {ENQUIRY_DEAD_LETTER_KEY}" if saved else "not recoverable: no Redis",
+        )
+
+
+@app.post(
+    "/api/enquiries",
+    response_model=EnquiryOut,
+    status_code=202,
+    # FastAPI only documents the 422 for declared body/params, so add it back
+    responses={
+        415: {"description": "Body is not JSON"},
+        422: {
+            "description": "Validation Error",
+            "content": {
+                "application/json": {
+                    "schema": {"$ref": "#/components/schemas/HTTPValidationError"}
+                }
+            },
+        }
+    },
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": EnquiryIn.model_json_schema()}},
+        }
+    },
+)
+async def create_enquiry(request: Request, background: BackgroundTasks):
+    # Only accept JSON bodies: text/plain and form posts are CORS "simple"
+    # requests that browsers send cross-site without a preflight
+    media_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if media_type != "application/json" and not media_type.endswith("+json"):
+        raise HTTPException(status_code=415, detail="Content-Type must be application/json")
+    try:
+        payload = _ENQUIRY_ADAPTER.validate_json(await request.body())
+    except ValidationError as e:
+        # Same 422 shape FastAPI produces for a declared body parameter
+        raise RequestValidationError(
+            [{**err, "loc": ("body", *err["loc"])} for err in e.errors()]
+        )
+    if db is None:
+        raise HTTPException(
+            status_code=500,
+            detail="Failed to submit: Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.",
+        )
+    # Id is generated client-side so we can answer before the insert lands
+    oid = ObjectId()
+    now = datetime.now(timezone.utc)
+    data = payload.model_dump()
+    data["_id"] = oid
+    data["created_at"] = now
+    background.add_task(_store_enquiry, data)
+    return EnquiryOut(id=str(oid), created_at=now)
 
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    uvicorn.run(app, host="0.0.0.0", port=port, loop="uvloop", http="httptools", backlog=2048)